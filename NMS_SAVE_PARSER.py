@@ -1,122 +1,19 @@
 #!/usr/bin/env python3
 
 import json
-import struct
-import subprocess
 import sys
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Mapping, Tuple
 
-import lz4.block
-import msgpack
-import spookyhash
 from PyQt5 import QtCore, QtWidgets
 from pytimeparse.timeparse import timeparse
-from requests import Session
-
-_MASK = (1 << 64) - 1
-_ORD_0 = ord(b'0')
-_ORD_Z = ord(b'Z')
-
-
-# rewritten as per https://github.com/monkeyman192/MBINCompiler/blob/development/SaveFileMapping/Program.cs
-def _hash(s: str) -> str:
-    hashed = spookyhash.hash128(s.encode("utf-8"), 8268756125562466087, 8268756125562466087) & _MASK
-    return "".join(
-        chr(av if av <= _ORD_Z else av + 6)
-        for av in (
-            v % 68 + _ORD_0
-            for v in (
-                hashed,
-                hashed >> 21,
-                hashed >> 42
-            )
-        )
-    )
-
-
-def _fetch(
-    update_mapping: bool = False,
-    force_fetch_json: bool = False,
-    force_fetch_jar: bool = False
-) -> Tuple[str, str, Mapping[str, str]]:
-    (tmp := Path("tmp")).mkdir(0o755, True, True)
-
-    if (mapping_path := tmp / "mapping.bin").exists() and not update_mapping:
-        with open(mapping_path, "rb") as f:
-            data = msgpack.unpackb(lz4.block.decompress(f.read()))
-            return data.pop("json"), data.pop("jar"), data.pop("mapping")
-
-    if not (json_path := tmp / "mapping.json").exists() or force_fetch_json:
-        with Session() as session:
-            version = Path(session.head(
-                "https://github.com/monkeyman192/MBINCompiler/releases/latest",
-                allow_redirects=False
-            ).headers["Location"]).name
-            json_content = session.get(
-                f"https://github.com/monkeyman192/MBINCompiler/releases/download/{version}/mapping.json"
-            ).text
-
-        loaded_json = json.loads(json_content)
-        with open(json_path, "w", encoding="utf-8") as f:
-            json.dump(loaded_json, f, separators=(',', ':'))
-    else:
-        with open(json_path, "r", encoding="utf-8") as f:
-            loaded_json = json.load(f)
-    json_version = loaded_json.pop("libMBIN_version")
-    mapping = {
-        m.pop("Key"): m.pop("Value")
-        for m in loaded_json.pop("Mapping")
-    }
-
-    if not (jar_path := tmp / "NMSSaveEditor.jar").exists() or force_fetch_jar:
-        with Session() as session:
-            jar_res = session.get("https://github.com/goatfungus/NMSSaveEditor/raw/master/NMSSaveEditor.jar")
-        with open(jar_path, "wb") as f:
-            f.write(jar_res.content)
-        with open(jar_path, "wb") as f:
-            f.write(jar_res.content)
-
-    if subprocess.run(["jar", "-xf", "NMSSaveEditor.jar"], cwd=tmp).returncode:
-        sys.exit(1)
-
-    with open(tmp / "nomanssave/db/jsonmap.txt", "r") as f:
-        mapping.update(
-            line.split()
-            for line in f.read().splitlines()
-            if line
-        )
-    with open(tmp / "META-INF/MANIFEST.MF", "r") as f:
-        meta = {
-            k: v
-            for k, v in (
-                line.split(": ")
-                for line in f.read().splitlines()
-                if line
-            )
-        }
-        jar_version = meta["Implementation-Version"]
-    for k, v in mapping.items():
-        if k != (hv := _hash(v)):
-            raise RuntimeError(f"{v} has inconsistent hash: {k} vs {hv}")
-
-    with open(mapping_path, "wb") as f:
-        f.write(lz4.block.compress(msgpack.packb({
-            "json": json_version,
-            "jar": jar_version,
-            "mapping": mapping
-        }), mode="high_compression", compression=12))
-
-    return json_version, jar_version, mapping
-
-
-_LIBMBIN_VERSION, _NMSSAVEEDITOR_VERSION, _DECODING = _fetch()
-_ENCODING = {
-    v: k
-    for k, v in _DECODING.items()
-}
+
+from _codec import decode, encode, write_file
+from _container import ContainerError
+from _mapping import _load
+
+_LIBMBIN_VERSION, _NMSSAVEEDITOR_VERSION, _DECODING, _ENCODING = _load()
 
 
 NMS_FILE_TYPE = ['As Source (*.hg)',
@@ -186,19 +83,20 @@ class JsonDelegate(QtWidgets.QItemDelegate):
         try:
             item = self.tree.currentItem()
             if SHOW_DATETIME:
-                if type(item.data[index.column()]) == datetime:
-                    item.data[index.column()] = datetime.fromisoformat(editor.text())
-                elif type(item.data[index.column()]) == timedelta:
-                    item.data[index.column()] = timedelta(seconds=timeparse(editor.text()))
+                if type(item.values[index.column()]) == datetime:
+                    item.values[index.column()] = datetime.fromisoformat(editor.text())
+                elif type(item.values[index.column()]) == timedelta:
+                    item.values[index.column()] = timedelta(seconds=timeparse(editor.text()))
                 else:
-                    item.data[index.column()] = type(item.data[index.column()])(editor.text())
+                    item.values[index.column()] = type(item.values[index.column()])(editor.text())
             else:
-                item.data[index.column()] = type(item.data[index.column()])(editor.text())
-            super(JsonDelegate, self).setModelData(editor, model, index)
+                item.values[index.column()] = type(item.values[index.column()])(editor.text())
+            # the base class would store the text a second time through setData
+            item.emitDataChanged()
             if index.column() == 0:
                 item.parent().remap_node()
         except ValueError:
-            self.notificator.setText('Invalid Value, expect ' + str(type(self.tree.currentItem().data[index.column()])))
+            self.notificator.setText('Invalid Value, expect ' + str(type(self.tree.currentItem().values[index.column()])))
         except TypeError:
             self.notificator.setText('Invalid Datetime format, expected YYYY-MM-DD hh-mm-ss')
 
@@ -207,10 +105,16 @@ class JsonNode(QtWidgets.QTreeWidgetItem):
 
     def __init__(self, data):
         self.is_list = False
-        self.data = data
+        self.values = data
         self.dataEdit = [True, data[1] is not None]
         self.node = dict()
-        super(JsonNode, self).__init__([str(d) for d in data if d is not None])
+        super(JsonNode, self).__init__()
+
+    # texts are served from self.values instead of being copied into the item
+    def data(self, column, role):
+        if role in (QtCore.Qt.DisplayRole, QtCore.Qt.EditRole) and column < 2 and self.values[column] is not None:
+            return self.values[column] if type(self.values[column]) == str else str(self.values[column])
+        return super(JsonNode, self).data(column, role)
 
     def find(self, find_str, find_condition):
         queue = []
@@ -222,14 +126,15 @@ class JsonNode(QtWidgets.QTreeWidgetItem):
 
     def addChild(self, child):
         super(JsonNode, self).addChild(child)
-        self.node[child.data[0]] = child
+        self.node[child.values[0]] = child
 
     def set_value(self, value):
-        self.data[1] = value
-        self.setText(1, str(value))
+        self.values[1] = value
+        # data() reads self.values, views only need to hear about the change
+        self.emitDataChanged()
 
     def remap_node(self):
-        self.node = dict([(v.data[0], v) for v in self.node.values()])
+        self.node = dict([(v.values[0], v) for v in self.node.values()])
 
 
 class JsonView(QtWidgets.QWidget):
@@ -239,6 +144,8 @@ class JsonView(QtWidgets.QWidget):
         self.find_box = None
         self.tree_widget = None
         self.json_data = None
+        # shared strings of the save being loaded, dropped once its tree is built
+        self.strings = {}
         self.find_str = None
         self.find_queue = []
         self.find_idx = 0
@@ -273,31 +180,30 @@ class JsonView(QtWidgets.QWidget):
 
         self.setLayout(layout2)
 
+    # False for a save that failed to load, the previous one is kept then
     def open_file(self, path):
         self.notification.setText('Loading...')
         self.notification.repaint()
-        self.json_data = load_file(path)
+        self.strings = {}
+        try:
+            self.json_data = load_file(path, self.strings)
+        except ContainerError as e:
+            self.notification.setText('Invalid save ' + str(e))
+            return False
         self.reset()
         self.gbox.setTitle(Path(path).name)
+        return True
 
     def save_file(self, path, mode):
         if mode == 0:
             mode = SRC_MODE
         self.notification.setText('Saving...')
         self.notification.repaint()
-        data = serialize_json(self.root_item)
-        if mode < 3:
-            map_keys(data, _ENCODING)
-
-        if mode != 2:
-            with open(path, 'wb') as file:
-                file.write(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
-                if mode == 1:
-                    file.write(b'\x00')
-
-        if mode == 2:
-            with open(path, 'wb') as file:
-                file.write(compress_file(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')))
+        try:
+            write_file(path, encode(serialize_json(self.root_item), mode, _ENCODING, SLICE))
+        except ContainerError as e:
+            self.notification.setText('Save aborted, invalid output ' + str(e))
+            return
 
         self.notification.setText('Ready')
 
@@ -311,18 +217,19 @@ class JsonView(QtWidgets.QWidget):
             self.root_item = self.recurse_json(self.json_data)
             self.tree_widget.addTopLevelItem(self.root_item)
             self.tree_widget.setItemDelegate(JsonDelegate(self.tree_widget, self.notification))
+        self.strings = {}
         self.notification.setText('Ready')
         self.notification.repaint()
 
     def export_node(self):
         if item := self.tree_widget.currentItem():
             global PATH
-            path, f = QtWidgets.QFileDialog.getSaveFileName(self, 'Save node', PATH + '\\' + ((item.parent().data[0]+'_'+item.data[0]) if item.parent() and item.parent().is_list else item.data[0]), 'Format json (*.json);;Minify json (*.json);;All Files (*)')
+            path, f = QtWidgets.QFileDialog.getSaveFileName(self, 'Save node', PATH + '\\' + ((item.parent().values[0]+'_'+item.values[0]) if item.parent() and item.parent().is_list else item.values[0]), 'Format json (*.json);;Minify json (*.json);;All Files (*)')
             if path:
                 PATH = str(Path(path).parent)
                 save_config()
                 with open(path, 'wb') as file:
-                    file.write(json.dumps(serialize_json(item) if item.data[1] is None else {item.data[0]: item.data[1]}, separators=(',', ':') if f == 'Minify json (*.json)' else None, ensure_ascii=False).encode('utf-8'))
+                    file.write(json.dumps(serialize_json(item) if item.values[1] is None else {item.values[0]: item.values[1]}, separators=(',', ':') if f == 'Minify json (*.json)' else None, ensure_ascii=False).encode('utf-8'))
 
     def find_toolbar(self):
         # Text box
@@ -389,7 +296,7 @@ class JsonView(QtWidgets.QWidget):
             node.is_list = True
             ts_list = key in DATETIME_LIST_LIST
             for i, val in enumerate(data):
-                key = str(i)
+                key = self.strings.setdefault(str(i), str(i))
                 row_item = self.recurse_json(val, key, ts_list)
                 row_item.setFlags(row_item.flags() | QtCore.Qt.ItemIsEditable)
                 row_item.dataEdit[0] = False
@@ -407,8 +314,8 @@ class JsonView(QtWidgets.QWidget):
 
     def exd_complete(self):
         try:
-            if (sd := self.root_item.node['PlayerStateData'].node['SeasonData']).node['SeasonId'].data[1] != 0:
-                expd_ms = [ms.node['Amount'].data[1] for stg in sd.node['Stages'].node.values() for ms in stg.node['Milestones'].node.values()]
+            if (sd := self.root_item.node['PlayerStateData'].node['SeasonData']).node['SeasonId'].values[1] != 0:
+                expd_ms = [ms.node['Amount'].values[1] for stg in sd.node['Stages'].node.values() for ms in stg.node['Milestones'].node.values()]
                 ms_v = self.root_item.node['PlayerStateData'].node['SeasonState'].node['MilestoneValues']
                 self.tree_widget.setCurrentItem(ms_v)
                 expd_ms_store = ms_v.node.values()
@@ -426,22 +333,21 @@ class JsonView(QtWidgets.QWidget):
             print(':angri:', e)
 
     def switch_judgement(self, judge):
-        if not self.tree_widget.currentItem() or self.tree_widget.currentItem().data[0] != 'SettlementJudgementType':
+        if not self.tree_widget.currentItem() or self.tree_widget.currentItem().values[0] != 'SettlementJudgementType':
             self.find_box.setText('SettlementJudgementType')
             self.find()
         else:
-            self.notification.setText(self.tree_widget.currentItem().data[1] + ' -> ' + judge)
-            self.tree_widget.currentItem().setText(1, judge)
-            self.tree_widget.currentItem().data[1] = judge
+            self.notification.setText(self.tree_widget.currentItem().values[1] + ' -> ' + judge)
+            self.tree_widget.currentItem().set_value(judge)
 
     def fix_timestamp(self, force=False):
         def value_type_find(find_type, obj):
-            return type(obj.data[1]) == find_type and (force or ('Seed' not in obj.data[0] and 'Dead' not in obj.data[0] and 'UTC' not in obj.data[0])) and obj.data[1] > datetime.now()
+            return type(obj.values[1]) == find_type and (force or ('Seed' not in obj.values[0] and 'Dead' not in obj.values[0] and 'UTC' not in obj.values[0])) and obj.values[1] > datetime.now()
         datetime_list = self.root_item.find(datetime, value_type_find)
         for item in datetime_list:
-            print(item.data[0]+':', item.data[1], '-> ', end='')
+            print(item.values[0]+':', item.values[1], '-> ', end='')
             item.set_value(datetime.now() - timedelta(hours=2))
-            print(item.data[1])
+            print(item.values[1])
         self.notification.setText('Tried to fix ' + str(len(datetime_list)) + ' items, check console output for detail')
 
 
@@ -524,15 +430,18 @@ class JsonViewer(QtWidgets.QMainWindow):
 
     def open_file(self, path=None):
         global PATH
-        self.path = path or QtWidgets.QFileDialog.getOpenFileName(self, 'Open file', PATH, 'NMS Save (*.hg);;All Files (*)')[0]
-        if self.path:
-            PATH = str(Path(self.path).parent)
-            name = Path(self.path).name
+        path = path or QtWidgets.QFileDialog.getOpenFileName(self, 'Open file', PATH, 'NMS Save (*.hg);;All Files (*)')[0]
+        if path:
+            PATH = str(Path(path).parent)
+            name = Path(path).name
             if name.startswith('mf_'):
                 print(':angri:! Is', name, 'a metafile? Tried to load corresponding save file')
-                self.path = str(Path(PATH, name.lstrip('mf_')))
+                path = str(Path(PATH, name.lstrip('mf_')))
             save_config()
-            self.json_view.open_file(self.path)
+            # a save that failed to load must never become the target of Save
+            if not self.json_view.open_file(path):
+                return
+            self.path = path
             for action in self.file.actions():
                 action.setDisabled(False)
             self.tool.setDisabled(False)
@@ -541,7 +450,11 @@ class JsonViewer(QtWidgets.QMainWindow):
             self.exp.setDisabled(False)
 
     def reload_file(self):
-        self.json_view.open_file(self.path)
+        # a save corrupted on disk since it was opened is not written over, the loaded tree stays editable for Save As
+        if not self.json_view.open_file(self.path):
+            # Save, Reload
+            for idx in (1, 4):
+                self.file.actions()[idx].setDisabled(True)
 
     def save_file(self):
         self.json_view.save_file(self.path, SRC_MODE)
@@ -561,7 +474,7 @@ class JsonViewer(QtWidgets.QMainWindow):
 
 
 def default_find(find_str, obj):
-    return find_str in '#'.join([str(i) for i in obj.data]).lower()
+    return find_str in '#'.join([str(i) for i in obj.values]).lower()
 
 
 def load_config():
@@ -586,73 +499,30 @@ def save_config():
         json.dump({'PATH': PATH, 'SAVE_MODE': SAVE_MODE, 'SLICE': SLICE, 'SHOW_DATETIME': SHOW_DATETIME}, config)
 
 
-def map_keys(node, mapping):
-    if isinstance(node, dict):
-        for k in list(node.keys()):
-            if k in mapping:
-                node[mapping[k]] = node.pop(k)
-            else:
-                print('Key mapping not found: ', k)
-        for k in node.keys():
-            map_keys(node[k], mapping)
-    elif isinstance(node, list):
-        for k in node:
-            map_keys(k, mapping)
-
-
 def serialize_json(node):
-    if node.data[1] is not None:
+    if node.values[1] is not None:
         if SHOW_DATETIME:
-            if type(node.data[1]) == datetime:
-                return int(time.mktime(node.data[1].timetuple()))
-                # return int(node.data[1].timestamp()) # Unable to use due to python bug :angri:
-            elif type(node.data[1]) == timedelta:
-                return int(node.data[1].total_seconds())
-        return node.data[1]
+            if type(node.values[1]) == datetime:
+                return int(time.mktime(node.values[1].timetuple()))
+                # return int(node.values[1].timestamp()) # Unable to use due to python bug :angri:
+            elif type(node.values[1]) == timedelta:
+                return int(node.values[1].total_seconds())
+        return node.values[1]
     elif node.is_list:
         return [serialize_json(node.child(i)) for i in range(node.childCount())]
     else:
         data = dict()
         for i in range(node.childCount()):
-            data[node.child(i).data[0]] = serialize_json(node.child(i))
+            data[node.child(i).values[0]] = serialize_json(node.child(i))
         return data
 
 
-def compress_file(data):
-    ret = b''
-    while block := data[:SLICE]:
-        data = data[SLICE:]
-        block += b'\x00' if len(block) < SLICE and block[-1] != b'\x00' else b''
-        c = lz4.block.compress(block, store_size=False)
-        ret += b'\xE5\xA1\xED\xFE' + struct.pack('i', len(c)) + struct.pack('i', len(block)) + b'\x00' * 4 + c
-    return ret
-
-
 # return mapped json object
-def load_file(file_path):
+def load_file(file_path, strings=None):
     global SRC_MODE
     with open(file_path, 'rb') as src:
-        dest = b''
-        while src.read(4) == b'\xE5\xA1\xED\xFE':
-            block_size = struct.unpack('i', src.read(4))[0]
-            dest_size = struct.unpack('i', src.read(4))[0]
-            src.read(4)
-            dest += lz4.block.decompress(src.read(block_size), uncompressed_size=dest_size)
-            # print('block_size:', block_size, 'dest_size:', dest_size, 'actual_size:', len(dest))
-
-        if src.read(1):
-            src.seek(0)
-            dest = src.read().rstrip(b'\x00')
-            SRC_MODE = 3
-        else:
-            dest = dest.rstrip(b'\x00')
-            SRC_MODE = 2
-        data = json.loads(dest.decode('utf-8'))
-        if len([k for k in data.keys() if len(k) == 3]) > 3:
-            map_keys(data, _DECODING)
-            if SRC_MODE == 3:
-                SRC_MODE = 1
-        return data
+        data, SRC_MODE = decode(src.read(), _DECODING, strings)
+    return data
 
 
 def main(argv):
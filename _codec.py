@@ -0,0 +1,119 @@
+import json
+import os
+from typing import Dict, Mapping, Optional, Tuple
+
+import lz4.block as lb
+
+from _container import ContainerError, inflate_block, locate, pack_header, scan, verify
+
+# save modes, see convert.py
+AS_SOURCE, UNCOMPRESSED, COMPRESSED, MAPPED = range(4)
+
+
+def map_keys(node, mapping):
+    if isinstance(node, dict):
+        for k in list(node.keys()):
+            if k in mapping:
+                node[mapping[k]] = node.pop(k)
+            else:
+                print('Key mapping not found: ', k)
+        for k in node.keys():
+            map_keys(node[k], mapping)
+    elif isinstance(node, list):
+        for k in node:
+            map_keys(k, mapping)
+
+
+# interns keys and string values while json.loads builds each object, so repeated strings are dropped as they are parsed
+def string_interner(strings: Dict[str, str]):
+    def intern_list(items):
+        for i, v in enumerate(items):
+            if type(v) is str:
+                items[i] = strings.setdefault(v, v)
+            elif type(v) is list:
+                intern_list(v)
+        return items
+
+    def hook(pairs):
+        node = {}
+        for k, v in pairs:
+            if type(v) is str:
+                v = strings.setdefault(v, v)
+            elif type(v) is list:
+                # objects in it went through this hook already
+                intern_list(v)
+            node[strings.setdefault(k, k)] = v
+        return node
+    return hook
+
+
+def compress(data: bytes, slice_size: int = 524288) -> bytes:
+    ret = b''
+    while block := data[:slice_size]:
+        data = data[slice_size:]
+        block += b'\x00' if len(block) < slice_size and block[-1] != b'\x00' else b''
+        c = lb.compress(block, store_size=False)
+        ret += pack_header(len(c), len(block)) + c
+    return ret
+
+
+# return mapped json object and the mode it was stored in
+def decode(raw: bytes, decoding: Mapping[str, str], strings: Optional[Dict[str, str]] = None) -> Tuple[dict, int]:
+    # every failure is reported as a ContainerError naming the first bad block, headers are checked up front
+    if blocks := scan(raw):
+        chunks = []
+        for idx, block in enumerate(blocks):
+            try:
+                chunks.append(inflate_block(raw, block))
+            except lb.LZ4BlockError as e:
+                raise ContainerError(f'corrupt LZ4 data ({e})', block[0], idx) from None
+        dest = b''.join(chunks).rstrip(b'\x00')
+        mode = COMPRESSED
+    else:
+        dest = raw.rstrip(b'\x00')
+        mode = MAPPED
+    try:
+        # a table per load, callers pass their own to keep sharing with what they build from it
+        data = json.loads(dest.decode('utf-8'), object_pairs_hook=string_interner({} if strings is None else strings))
+    except UnicodeDecodeError as e:
+        raise ContainerError(f'invalid UTF-8 ({e.reason}) at inflated byte {e.start}', *locate(blocks, e.start)) from None
+    except json.JSONDecodeError as e:
+        raise ContainerError(f'invalid JSON ({e.msg}) at inflated char {e.pos}', *locate(blocks, e.pos)) from None
+    if not isinstance(data, dict):
+        raise ContainerError('top level JSON value is not an object', *locate(blocks, 0))
+    if len([k for k in data.keys() if len(k) == 3]) > 3:
+        map_keys(data, decoding)
+        if mode == MAPPED:
+            mode = UNCOMPRESSED
+    return data, mode
+
+
+def remapped(node, mapping):
+    if isinstance(node, dict):
+        return {mapping.get(k, k): remapped(v, mapping) for k, v in node.items()}
+    if isinstance(node, list):
+        return [remapped(v, mapping) for v in node]
+    return node
+
+
+# keys of `data` are remapped in place unless saving as mapped, or on a copy when `in_place` is off
+def encode(data: dict, mode: int, encoding: Mapping[str, str], slice_size: int = 524288, in_place: bool = True) -> bytes:
+    if mode < MAPPED:
+        if in_place:
+            map_keys(data, encoding)
+        else:
+            data = remapped(data, encoding)
+    raw = json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    if mode == COMPRESSED:
+        return compress(raw, slice_size)
+    return raw + b'\x00' if mode == UNCOMPRESSED else raw
+
+
+# the encoded save is checked before it replaces anything on disk, `check` is off only for non-save files
+def write_file(path, raw: bytes, check: bool = True):
+    if check:
+        verify(raw, decompress=True)
+    part = f'{path}.part'
+    with open(part, 'wb') as file:
+        file.write(raw)
+    os.replace(part, path)
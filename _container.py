@@ -0,0 +1,137 @@
+import json
+import mmap
+import struct
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from itertools import accumulate
+from typing import Iterator, List, Optional, Tuple
+
+import lz4.block as lb
+
+MAGIC = b'\xE5\xA1\xED\xFE'
+# magic, compressed size, decompressed size, padding
+HEADER = struct.Struct('<4siii')
+
+
+class ContainerError(ValueError):
+
+    def __init__(self, message: str, offset: int, block: Optional[int] = None):
+        self.offset = offset
+        self.block = block
+        super(ContainerError, self).__init__(
+            (f'block {block} ' if block is not None else '') + f'at offset {offset}: {message}'
+        )
+
+
+def pack_header(block_size: int, dest_size: int) -> bytes:
+    return HEADER.pack(MAGIC, block_size, dest_size, 0)
+
+
+def iter_blocks(data: bytes) -> Iterator[Tuple[int, int, bytes]]:
+    """Yield (offset, dest_size, payload) for each LZ4 block, stopping at the first header that is not a whole block."""
+    offset = 0
+    while len(data) - offset >= HEADER.size:
+        magic, block_size, dest_size, _ = HEADER.unpack_from(data, offset)
+        if magic != MAGIC or block_size < 0 or offset + HEADER.size + block_size > len(data):
+            return
+        yield offset, dest_size, data[offset + HEADER.size:offset + HEADER.size + block_size]
+        offset += HEADER.size + block_size
+
+
+# (offset, block_size, dest_size) of every block from the headers alone, empty for an uncompressed save
+def scan(data) -> List[Tuple[int, int, int]]:
+    if not len(data):
+        raise ContainerError('empty file', 0)
+    if data[:len(MAGIC)] != MAGIC:
+        if data[:1] != b'{':
+            raise ContainerError('neither a compressed block nor a JSON object', 0)
+        return []
+
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        if len(data) - offset < HEADER.size or data[offset:offset + len(MAGIC)] != MAGIC:
+            raise ContainerError('expected a block header', offset, len(blocks))
+        _, block_size, dest_size, _ = HEADER.unpack_from(data, offset)
+        # LZ4 never expands beyond its compress bound nor shrinks past 255:1
+        if dest_size <= 0 or not 0 < block_size <= dest_size + dest_size // 255 + 16 or dest_size > block_size * 255:
+            raise ContainerError(f'implausible sizes {block_size} -> {dest_size}', offset, len(blocks))
+        if offset + HEADER.size + block_size > len(data):
+            raise ContainerError(f'block of {block_size} bytes runs past end of file ({len(data)})', offset, len(blocks))
+        blocks.append((offset, block_size, dest_size))
+        offset += HEADER.size + block_size
+    return blocks
+
+
+def inflate_block(data, block: Tuple[int, int, int]) -> bytes:
+    offset, block_size, dest_size = block
+    start = offset + HEADER.size
+    return lb.decompress(data[start:start + block_size], uncompressed_size=dest_size)
+
+
+def _discard(_):
+    return None
+
+
+def verify(data, decompress: bool = False, structure: bool = False, workers: Optional[int] = None) -> int:
+    """Check a save container, raising ContainerError at the first bad block, and return its block count.
+
+    Headers are always checked, `decompress` also inflates every block in parallel and `structure` parses the
+    JSON, keeping no objects.
+    """
+    blocks = scan(data)
+    if not (decompress or structure):
+        return len(blocks)
+
+    if blocks:
+        pool = ThreadPoolExecutor(workers)
+        try:
+            results = pool.map(lambda b: inflate_block(data, b), blocks)
+            chunks = []
+            for idx, block in enumerate(blocks):
+                try:
+                    chunk = next(results)
+                except lb.LZ4BlockError as e:
+                    raise ContainerError(f'corrupt LZ4 data ({e})', block[0], idx) from None
+                if len(chunk) != block[2]:
+                    raise ContainerError(f'inflated to {len(chunk)} bytes instead of {block[2]}', block[0], idx)
+                if structure:
+                    chunks.append(chunk)
+        finally:
+            # stop at the first bad block rather than inflating the rest
+            pool.shutdown(cancel_futures=True)
+        payload = b''.join(chunks)
+    else:
+        payload = bytes(data)
+
+    if structure:
+        text = payload.rstrip(b'\x00')
+        try:
+            text = text.decode('utf-8')
+            end = json.JSONDecoder(object_hook=_discard).raw_decode(text)[1]
+            if text[end:].strip():
+                raise json.JSONDecodeError('Extra data', text, end)
+        except UnicodeDecodeError as e:
+            raise ContainerError(f'invalid UTF-8 ({e.reason}) at inflated byte {e.start}', *locate(blocks, e.start)) from None
+        except json.JSONDecodeError as e:
+            # JSON positions count characters, good enough to point at the block
+            raise ContainerError(f'invalid JSON ({e.msg}) at inflated char {e.pos}', *locate(blocks, e.pos)) from None
+    return len(blocks)
+
+
+# map an offset of the inflated stream back to (file offset of its block, block index)
+def locate(blocks: List[Tuple[int, int, int]], pos: int) -> Tuple[int, Optional[int]]:
+    if not blocks:
+        return pos, None
+    idx = min(bisect_right(list(accumulate(b[2] for b in blocks)), pos), len(blocks) - 1)
+    return blocks[idx][0], idx
+
+
+def verify_file(path, decompress: bool = False, structure: bool = False, workers: Optional[int] = None) -> int:
+    with open(path, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise ContainerError('empty file', 0) from None
+        with data:
+            return verify(data, decompress, structure, workers)
@@ -0,0 +1,233 @@
+import json
+import os
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Mapping, Tuple
+
+import lz4.block
+import msgpack
+import spookyhash
+from requests import RequestException, Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# overridable so a local stand-in server can be used instead of GitHub
+MBIN_RELEASES_URL = "https://github.com/monkeyman192/MBINCompiler/releases"
+JAR_URL = "https://github.com/goatfungus/NMSSaveEditor/raw/master/NMSSaveEditor.jar"
+# (connect, read) seconds, read is per chunk rather than the whole download
+TIMEOUT = (5, 30)
+RETRIES = 3
+# a cached mapping older than this is refreshed in the background, at most once per period
+MAX_AGE = 24 * 60 * 60
+# a fetch lock older than this was left behind by a killed process
+LOCK_TIMEOUT = 10 * 60
+
+class MappingError(RuntimeError):
+    pass
+
+
+_MASK = (1 << 64) - 1
+_ORD_0 = ord(b'0')
+_ORD_Z = ord(b'Z')
+
+
+# rewritten as per https://github.com/monkeyman192/MBINCompiler/blob/development/SaveFileMapping/Program.cs
+def _hash(s: str) -> str:
+    hashed = spookyhash.hash128(s.encode("utf-8"), 8268756125562466087, 8268756125562466087) & _MASK
+    return "".join(
+        chr(av if av <= _ORD_Z else av + 6)
+        for av in (
+            v % 68 + _ORD_0
+            for v in (
+                hashed,
+                hashed >> 21,
+                hashed >> 42
+            )
+        )
+    )
+
+
+def _session() -> Session:
+    session = Session()
+    adapter = HTTPAdapter(max_retries=Retry(
+        total=RETRIES,
+        backoff_factor=0.5,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=("HEAD", "GET")
+    ))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# stream to a sibling .part file first, so an interrupted download never replaces a good one
+def _download(session: Session, url: str, path: Path) -> Path:
+    part = path.with_name(path.name + ".part")
+    with session.get(url, stream=True, timeout=TIMEOUT) as res:
+        res.raise_for_status()
+        with open(part, "wb") as f:
+            for chunk in res.iter_content(1 << 16):
+                f.write(chunk)
+    part.replace(path)
+    return path
+
+
+def _fetch_json(session: Session, json_path: Path) -> Path:
+    res = session.head(f"{MBIN_RELEASES_URL}/latest", allow_redirects=False, timeout=TIMEOUT)
+    res.raise_for_status()
+    version = Path(res.headers["Location"]).name
+    return _download(session, f"{MBIN_RELEASES_URL}/download/{version}/mapping.json", json_path)
+
+
+# one process at a time downloads into and extracts the jar in tmp/
+@contextmanager
+def _lock(path: Path, wait: bool = True) -> Iterator[bool]:
+    while True:
+        try:
+            os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL))
+            break
+        except FileExistsError:
+            try:
+                if time.time() - path.stat().st_mtime > LOCK_TIMEOUT:
+                    path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            if not wait:
+                yield False
+                return
+            time.sleep(0.2)
+    try:
+        yield True
+    finally:
+        path.unlink(missing_ok=True)
+
+
+def _read_mapping(mapping_path: Path) -> Tuple[str, str, Mapping[str, str]]:
+    with open(mapping_path, "rb") as f:
+        data = msgpack.unpackb(lz4.block.decompress(f.read()))
+        return data.pop("json"), data.pop("jar"), data.pop("mapping")
+
+
+def _fetch(
+    update_mapping: bool = False,
+    force_fetch_json: bool = False,
+    force_fetch_jar: bool = False,
+    wait: bool = True
+) -> Tuple[str, str, Mapping[str, str]]:
+    (tmp := Path("tmp")).mkdir(0o755, True, True)
+
+    if (mapping_path := tmp / "mapping.bin").exists() and not update_mapping:
+        return _read_mapping(mapping_path)
+
+    with _lock(tmp / "fetch.lock", wait) as locked:
+        if not locked:
+            raise BlockingIOError("mapping is already being fetched by another process")
+        # another process may have finished the fetch while this one waited
+        if mapping_path.exists() and not update_mapping:
+            return _read_mapping(mapping_path)
+        return _fetch_sources(tmp, mapping_path, force_fetch_json, force_fetch_jar)
+
+
+def _fetch_sources(
+    tmp: Path,
+    mapping_path: Path,
+    force_fetch_json: bool,
+    force_fetch_jar: bool
+) -> Tuple[str, str, Mapping[str, str]]:
+    json_path = tmp / "mapping.json"
+    jar_path = tmp / "NMSSaveEditor.jar"
+    with _session() as session, ThreadPoolExecutor(2) as pool:
+        fetching = []
+        if not json_path.exists() or force_fetch_json:
+            fetching.append(pool.submit(_fetch_json, session, json_path))
+        if not jar_path.exists() or force_fetch_jar:
+            fetching.append(pool.submit(_download, session, JAR_URL, jar_path))
+        for future in fetching:
+            future.result()
+
+    with open(json_path, "r", encoding="utf-8") as f:
+        loaded_json = json.load(f)
+    json_version = loaded_json.pop("libMBIN_version")
+    mapping = {
+        m.pop("Key"): m.pop("Value")
+        for m in loaded_json.pop("Mapping")
+    }
+
+    if subprocess.run(["jar", "-xf", "NMSSaveEditor.jar"], cwd=tmp).returncode:
+        raise MappingError("failed to extract NMSSaveEditor.jar")
+
+    with open(tmp / "nomanssave/db/jsonmap.txt", "r") as f:
+        mapping.update(
+            line.split()
+            for line in f.read().splitlines()
+            if line
+        )
+    with open(tmp / "META-INF/MANIFEST.MF", "r") as f:
+        meta = {
+            k: v
+            for k, v in (
+                line.split(": ")
+                for line in f.read().splitlines()
+                if line
+            )
+        }
+        jar_version = meta["Implementation-Version"]
+    for k, v in mapping.items():
+        if k != (hv := _hash(v)):
+            raise MappingError(f"{v} has inconsistent hash: {k} vs {hv}")
+
+    part = mapping_path.with_name(mapping_path.name + ".part")
+    with open(part, "wb") as f:
+        f.write(lz4.block.compress(msgpack.packb({
+            "json": json_version,
+            "jar": jar_version,
+            "mapping": mapping
+        }), mode="high_compression", compression=12))
+    part.replace(mapping_path)
+
+    return json_version, jar_version, mapping
+
+
+# a missing Location header, a bad mapping.json and friends, all leave the cached mapping usable
+_FETCH_ERRORS = (OSError, RequestException, MappingError, KeyError, ValueError)
+
+
+def _refresh() -> None:
+    try:
+        _fetch(True, True, True, False)
+    except BlockingIOError:
+        pass
+    except _FETCH_ERRORS + (RuntimeError,) as e:
+        # a refresh cut short by interpreter exit is not worth reporting
+        if threading.main_thread().is_alive():
+            print(":angri: Failed to refresh mapping, keep using the cached one:", e)
+
+
+# only long running callers (GUI, server) should ask for a refresh, the daemon thread dies with a short lived one
+def _load(use_cache: bool = True, refresh: bool = True) -> Tuple[str, str, Mapping[str, str], Mapping[str, str]]:
+    mapping_path = Path("tmp", "mapping.bin")
+    stamp_path = Path("tmp", "refresh.stamp")
+    if use_cache and refresh and mapping_path.exists() and time.time() - max(
+        mapping_path.stat().st_mtime,
+        stamp_path.stat().st_mtime if stamp_path.exists() else 0
+    ) > MAX_AGE:
+        # the attempt is recorded up front, so a failing refresh waits another MAX_AGE
+        stamp_path.touch()
+        threading.Thread(target=_refresh, name="mapping-refresh", daemon=True).start()
+    try:
+        json_version, jar_version, decoding = _fetch() if use_cache else _fetch(True, True, True)
+    except _FETCH_ERRORS as e:
+        if use_cache or not mapping_path.exists():
+            raise
+        print(":angri: Failed to update mapping, fall back to the cached one:", e)
+        json_version, jar_version, decoding = _fetch()
+    encoding = {
+        v: k
+        for k, v in decoding.items()
+    }
+    return json_version, jar_version, decoding, encoding
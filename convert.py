@@ -1,79 +1,36 @@
 import argparse
-import json
-import struct
-
-import lz4.block as lb
+import sys
+import time
 
+from _codec import decode, encode, write_file
+from _container import ContainerError, verify_file
 from _mapping import _load
 
-_, _, _DECODING, _ENCODING = _load(True)
+_, _, _DECODING, _ENCODING = _load(True, False)
 
 
 def save_file(path, data):
     mode = SRC_MODE if SAVE_MODE == 0 else SAVE_MODE
-    if mode < 3:
-        map_keys(data, _ENCODING)
-
-    if mode != 2:
-        with open(path, 'wb') as file:
-            file.write(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
-            if mode == 1:
-                file.write(b'\x00')
-
-    if mode == 2:
-        with open(path, 'wb') as file:
-            file.write(compress_file(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8')))
-
-
-def map_keys(node, mapping):
-    if isinstance(node, dict):
-        for k in list(node.keys()):
-            if k in mapping:
-                node[mapping[k]] = node.pop(k)
-            else:
-                print('Key mapping not found: ', k)
-        for k in node.keys():
-            map_keys(node[k], mapping)
-    elif isinstance(node, list):
-        for k in node:
-            map_keys(k, mapping)
-
-
-def compress_file(data):
-    ret = b''
-    while block := data[:SLICE]:
-        data = data[SLICE:]
-        block += b'\x00' if len(block) < SLICE and block[-1] != b'\x00' else b''
-        c = lb.compress(block, store_size=False)
-        ret += b'\xE5\xA1\xED\xFE' + struct.pack('i', len(c)) + struct.pack('i', len(block)) + b'\x00' * 4 + c
-    return ret
+    write_file(path, encode(data, mode, _ENCODING, SLICE))
 
 
 # return mapped json object
 def load_file(file_path):
     global SRC_MODE
     with open(file_path, 'rb') as src:
-        dest = b''
-        while src.read(4) == b'\xE5\xA1\xED\xFE':
-            block_size = struct.unpack('i', src.read(4))[0]
-            dest_size = struct.unpack('i', src.read(4))[0]
-            src.read(4)
-            dest += lb.decompress(src.read(block_size), uncompressed_size=dest_size)
-            # print('block_size:', block_size, 'dest_size:', dest_size, 'actual_size:', len(dest))
+        data, SRC_MODE = decode(src.read(), _DECODING)
+    return data
+
 
-        if src.read(1):
-            src.seek(0)
-            dest = src.read().rstrip(b'\x00')
-            SRC_MODE = 3
-        else:
-            dest = dest.rstrip(b'\x00')
-            SRC_MODE = 2
-        data = json.loads(dest.decode('utf-8'))
-        if len([k for k in data.keys() if len(k) == 3]) > 3:
-            map_keys(data, _DECODING)
-            if SRC_MODE == 3:
-                SRC_MODE = 1
-        return data
+def check_file(file_path, level):
+    start = time.perf_counter()
+    try:
+        blocks = verify_file(file_path, level > 1, level > 2)
+    except ContainerError as e:
+        print(f'{file_path}: {e}')
+        return False
+    print(f'{file_path}: OK, {blocks or "uncompressed, no"} blocks in {(time.perf_counter() - start) * 1000:.1f} ms')
+    return True
 
 
 parser = argparse.ArgumentParser()
@@ -81,6 +38,7 @@ parser.add_argument('-i', type=str, help='input path for NMS Save (*.hg) file')
 parser.add_argument('-o', type=str, help='output path for NMS Save (*.hg) file')
 parser.add_argument('-m', '--mode', type=int, default=0, help='0 for as input, 1 for uncompressed, 2 for compressed, 3 for mapped')
 parser.add_argument('-s', '--slice', type=int, default=524288, help='save compress block size')
+parser.add_argument('-c', '--check', type=int, default=0, help='validate input only, 1 for block headers, 2 for decompress blocks, 3 for JSON structure')
 args, unknown = parser.parse_known_args()
 
 SRC_MODE = 1
@@ -88,7 +46,9 @@ SAVE_MODE = args.mode
 SLICE = args.slice
 
 data = None
-if src := args.i or unknown[0] if unknown else None:
+if (src := args.i or (unknown[0] if unknown else None)) and args.check:
+    sys.exit(0 if check_file(src, args.check) else 1)
+if src:
     data = load_file(src)
 if data:
     save_file(args.o or (unknown[1] if len(unknown) > 1 else None) or src, data)
@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import hmac
+import json
+import os
+import secrets
+import socket
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from _codec import AS_SOURCE, decode, encode, write_file
+from _mapping import _load
+
+SOCKET_PATH = Path('tmp', 'server.sock')
+# tcp clients must send this token, it is rewritten on every start
+TOKEN_PATH = Path('tmp', 'server.token')
+PORT = 8765
+# no unix sockets on Windows, tcp with the token is used there instead
+HAS_UNIX = hasattr(socket, 'AF_UNIX')
+
+_DECODING = None
+_ENCODING = None
+# parsed saves of this worker, the parent only ever sees paths and results
+_CACHE = OrderedDict()
+_CACHE_SIZE = 4
+
+
+# workers inherit the maps when forked, spawned workers load them once from tmp/mapping.bin
+def _warm(refresh=False, cache_size=None):
+    global _DECODING, _ENCODING, _CACHE_SIZE
+    if cache_size is not None:
+        _CACHE_SIZE = cache_size
+    if _DECODING is None:
+        _, _, _DECODING, _ENCODING = _load(True, refresh)
+
+
+def _remember(path, data, mode):
+    st = os.stat(path)
+    _CACHE[path] = entry = ((st.st_mtime_ns, st.st_size), data, mode)
+    _CACHE.move_to_end(path)
+    while len(_CACHE) > _CACHE_SIZE:
+        _CACHE.popitem(False)
+    return entry
+
+
+# entries are dropped once the file changes on disk, a table per save keeps interning from outliving it
+def _cached(path):
+    st = os.stat(path)
+    if (entry := _CACHE.get(path)) and entry[0] == (st.st_mtime_ns, st.st_size):
+        _CACHE.move_to_end(path)
+        return entry
+    with open(path, 'rb') as src:
+        return _remember(path, *decode(src.read(), _DECODING, {}))
+
+
+def _walk(data, key):
+    for k in (key.split('.') if isinstance(key, str) else key) if key else ():
+        data = data[int(k)] if isinstance(data, list) else data[k]
+    return data
+
+
+def _op_load(path):
+    _, data, mode = _cached(path)
+    return {'mode': mode, 'keys': list(data.keys())}
+
+
+def _op_query(path, key):
+    return _walk(_cached(path)[1], key)
+
+
+def _op_extract(path, key, out, minify):
+    node = _walk(_cached(path)[1], key)
+    if not isinstance(node, (dict, list)):
+        node = {(key.split('.') if isinstance(key, str) else key)[-1]: node}
+    with open(out, 'wb') as file:
+        file.write(json.dumps(node, separators=(',', ':') if minify else None, ensure_ascii=False).encode('utf-8'))
+    return out
+
+
+# the cached save is encoded from a remapped copy, so it stays usable afterwards
+def _op_convert(path, out, mode, slice_size):
+    _, data, src_mode = _cached(path)
+    raw = encode(data, mode or src_mode, _ENCODING, slice_size, False)
+    write_file(out, raw)
+    if out == path:
+        _remember(path, data, mode or src_mode)
+    return len(raw)
+
+
+def _op_save(path, data, mode, slice_size):
+    raw = encode(data, mode, _ENCODING, slice_size, False)
+    write_file(path, raw)
+    _remember(path, data, mode)
+    return len(raw)
+
+
+class SaveService:
+    """Each path is pinned to one single process worker holding its parsed save, so saves never cross processes."""
+
+    def __init__(self, workers=None, cache_size=4, slice_size=524288):
+        _warm(True)
+        self.token = None
+        self.pools = [
+            ProcessPoolExecutor(1, initializer=_warm, initargs=(False, cache_size))
+            for _ in range(workers or os.cpu_count() or 1)
+        ]
+        self.slice_size = slice_size
+        self.ops = {
+            'load': self.load,
+            'query': self.query,
+            'extract': self.extract,
+            'convert': self.convert,
+            'save': self.save,
+        }
+
+    async def dispatch(self, request):
+        if (op := self.ops.get(request.pop('op', None))) is None:
+            raise ValueError('unknown op, expected one of ' + ', '.join(self.ops))
+        return await op(**request)
+
+    async def _run(self, path, fn, *args):
+        pool = self.pools[zlib.crc32(path.encode('utf-8')) % len(self.pools)]
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, path, *args)
+
+    async def load(self, path):
+        return await self._run(str(Path(path).resolve()), _op_load)
+
+    async def query(self, path, key=None):
+        return await self._run(str(Path(path).resolve()), _op_query, key)
+
+    async def extract(self, path, key, out, minify=False):
+        return await self._run(str(Path(path).resolve()), _op_extract, key, out, minify)
+
+    async def convert(self, path, out, mode=AS_SOURCE):
+        return await self._run(str(Path(path).resolve()), _op_convert, str(Path(out).resolve()), mode, self.slice_size)
+
+    # write `data` (or the cached save) back, the owning worker then caches what was written
+    async def save(self, path, data=None, out=None, mode=AS_SOURCE):
+        if data is None:
+            return await self.convert(path, out or path, mode)
+        if not mode:
+            mode = (await self.load(path))['mode']
+        return await self._run(str(Path(out or path).resolve()), _op_save, data, mode, self.slice_size)
+
+    async def handle(self, reader, writer):
+        lock = asyncio.Lock()
+        tasks = set()
+
+        async def respond(request):
+            rid = request.pop('id', None)
+            try:
+                if self.token and not hmac.compare_digest(str(request.pop('token', '')), self.token):
+                    raise PermissionError('invalid token')
+                request.pop('token', None)
+                response = {'id': rid, 'result': await self.dispatch(request)}
+            except Exception as e:
+                response = {'id': rid, 'error': f'{type(e).__name__}: {e}'}
+            async with lock:
+                writer.write(json.dumps(response, separators=(',', ':'), ensure_ascii=False).encode('utf-8') + b'\n')
+                await writer.drain()
+
+        # one json object per line, answered as each finishes and matched by id,
+        # anything else (e.g. an HTTP request from a browser) drops the connection
+        while line := await reader.readline():
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            if not isinstance(request, dict):
+                break
+            (task := asyncio.create_task(respond(request))).add_done_callback(tasks.discard)
+            tasks.add(task)
+        await asyncio.gather(*tasks)
+        writer.close()
+
+    # a unix socket unless a port is given or there is none, tcp then requires the token written to TOKEN_PATH
+    async def serve(self, unix=SOCKET_PATH, host='127.0.0.1', port=None):
+        if port is None and not HAS_UNIX:
+            port = PORT
+        if port is None:
+            Path(unix).unlink(missing_ok=True)
+            server = await asyncio.start_unix_server(self.handle, unix, limit=1 << 28)
+            os.chmod(unix, 0o600)
+        else:
+            self.token = secrets.token_urlsafe(32)
+            TOKEN_PATH.unlink(missing_ok=True)
+            with open(os.open(TOKEN_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+                f.write(self.token)
+            server = await asyncio.start_server(self.handle, host, port, limit=1 << 28)
+        async with server:
+            await server.serve_forever()
+
+
+def call(op, address=None, **params):
+    """Send one request to a running server and return its result, a (host, port) address sends the token."""
+    if address is None:
+        address = SOCKET_PATH if HAS_UNIX else ('127.0.0.1', PORT)
+    if isinstance(address, tuple):
+        family = socket.AF_INET
+        params.setdefault('token', TOKEN_PATH.read_text())
+    else:
+        family = socket.AF_UNIX
+        address = str(address)
+    with socket.socket(family, socket.SOCK_STREAM) as sock:
+        sock.connect(address)
+        sock.sendall(json.dumps({'id': 0, 'op': op, **params}, ensure_ascii=False).encode('utf-8') + b'\n')
+        sock.shutdown(socket.SHUT_WR)
+        with sock.makefile('rb') as f:
+            response = json.loads(f.readline())
+    if 'error' in response:
+        raise RuntimeError(response['error'])
+    return response['result']
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-u', '--unix', type=str, default=str(SOCKET_PATH), help='unix socket to listen on')
+    parser.add_argument('-p', '--port', type=int, default=None, help=f'listen on localhost tcp instead (default on Windows, {PORT}), requests need the token from tmp/server.token')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='tcp address to listen on')
+    parser.add_argument('-w', '--workers', type=int, default=None, help='worker processes, each holding the saves pinned to it')
+    parser.add_argument('-c', '--cache', type=int, default=4, help='parsed saves kept in memory per worker')
+    parser.add_argument('-s', '--slice', type=int, default=524288, help='save compress block size')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(SaveService(args.workers, args.cache, args.slice).serve(args.unix, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
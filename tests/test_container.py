@@ -0,0 +1,95 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from _codec import COMPRESSED, MAPPED, UNCOMPRESSED, compress, decode, encode  # noqa: E402
+from _container import HEADER, ContainerError, scan, verify, verify_file  # noqa: E402
+
+SLICE = 64
+DECODING = {'abc': 'Version', 'def': 'Units', 'ghi': 'Inventory', 'jkl': 'Slots', 'mno': 'Name'}
+ENCODING = {v: k for k, v in DECODING.items()}
+
+
+def _save():
+    return {
+        'Version': 4135,
+        'Units': [1, 2, 3],
+        'Inventory': {'Slots': ['^FUEL1', '^FUEL1', '^LAUNCHSUB']},
+        'Name': 'Explorer ' * 8,
+    }
+
+
+@pytest.fixture
+def container():
+    raw = compress(encode(_save(), MAPPED, ENCODING, in_place=False), SLICE)
+    assert len(scan(raw)) > 2
+    return raw
+
+
+@pytest.mark.parametrize('mode', [UNCOMPRESSED, COMPRESSED, MAPPED])
+def test_round_trip(mode):
+    raw = encode(_save(), mode, ENCODING, SLICE)
+
+    assert (verify(raw, decompress=True, structure=True) > 1) == (mode == COMPRESSED)
+    assert decode(raw, DECODING) == (_save(), mode)
+
+
+def test_decode_shares_strings(container):
+    strings = {}
+    data = decode(container, DECODING, strings)[0]
+
+    slots = data['Inventory']['Slots']
+    assert slots[0] is slots[1] is strings['^FUEL1']
+
+
+def test_truncated_file(container, tmp_path):
+    truncated = container[:-10]
+    offset = scan(container)[-1][0]
+
+    for check in (lambda: verify(truncated), lambda: decode(truncated, DECODING)):
+        with pytest.raises(ContainerError, match='runs past end of file') as e:
+            check()
+        assert (e.value.offset, e.value.block) == (offset, len(scan(container)) - 1)
+
+    (path := tmp_path / 'save.hg').write_bytes(b'')
+    with pytest.raises(ContainerError, match='empty file'):
+        verify_file(path)
+
+
+def test_flipped_payload_byte(container, tmp_path):
+    offset, block_size, _ = scan(container)[1]
+    corrupt = bytearray(container)
+    # the last bytes of an LZ4 block are always literals, so this lands in the inflated text
+    corrupt[offset + HEADER.size + block_size - 1] = 0xFF
+    (path := tmp_path / 'save.hg').write_bytes(corrupt)
+
+    assert verify_file(path) == len(scan(container))
+    for check in (lambda: verify_file(path, structure=True), lambda: decode(bytes(corrupt), DECODING)):
+        with pytest.raises(ContainerError, match='invalid UTF-8') as e:
+            check()
+        assert (e.value.offset, e.value.block) == (offset, 1)
+
+
+def test_flipped_header_byte(container):
+    offset = scan(container)[1][0]
+    corrupt = bytearray(container)
+    corrupt[offset + 7] ^= 0x40
+
+    with pytest.raises(ContainerError, match='implausible sizes') as e:
+        verify(corrupt)
+    assert (e.value.offset, e.value.block) == (offset, 1)
+
+
+def test_trailing_garbage(container):
+    with pytest.raises(ContainerError, match='expected a block header') as e:
+        decode(container + b'garbage', DECODING)
+    assert (e.value.offset, e.value.block) == (len(container), len(scan(container)))
+
+    raw = encode(_save(), MAPPED, ENCODING, in_place=False)
+    for check in (lambda: verify(raw + b' garbage', structure=True), lambda: decode(raw + b' garbage', DECODING)):
+        with pytest.raises(ContainerError, match='Extra data') as e:
+            check()
+        assert e.value.block is None
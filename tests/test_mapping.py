@@ -0,0 +1,127 @@
+import io
+import json
+import sys
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import _mapping  # noqa: E402
+
+VALUES = ["PlayerStateData", "Units", "Nanites", "SeasonData"]
+
+
+def _jar():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w") as jar:
+        jar.writestr("META-INF/MANIFEST.MF", "Manifest-Version: 1.0\nImplementation-Version: 9.9\n")
+        jar.writestr("nomanssave/db/jsonmap.txt", "".join(f"{_mapping._hash(v)} {v}\n" for v in VALUES[2:]))
+    return buf.getvalue()
+
+
+class _StandIn(BaseHTTPRequestHandler):
+    routes = {}
+    hits = []
+
+    def do_HEAD(self):
+        self.hits.append(("HEAD", self.path))
+        self.send_response(302)
+        self.send_header("Location", "/releases/tag/v9.9")
+        self.end_headers()
+
+    def do_GET(self):
+        self.hits.append(("GET", self.path))
+        if (body := self.routes.get(self.path)) is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in(tmp_path, monkeypatch):
+    _StandIn.routes = {
+        "/releases/download/v9.9/mapping.json": json.dumps({
+            "libMBIN_version": "9.9.0",
+            "Mapping": [{"Key": _mapping._hash(v), "Value": v} for v in VALUES[:2]]
+        }).encode(),
+        "/NMSSaveEditor.jar": _jar(),
+    }
+    _StandIn.hits = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(_mapping, "MBIN_RELEASES_URL", base + "/releases")
+    monkeypatch.setattr(_mapping, "JAR_URL", base + "/NMSSaveEditor.jar")
+    monkeypatch.setattr(_mapping, "TIMEOUT", (2, 2))
+
+    # stands in for `jar -xf`, which needs a JDK
+    def extract(args, cwd):
+        try:
+            with zipfile.ZipFile(Path(cwd, args[-1])) as jar:
+                jar.extractall(cwd)
+        except zipfile.BadZipFile:
+            return type("Completed", (), {"returncode": 1})()
+        return type("Completed", (), {"returncode": 0})()
+    monkeypatch.setattr(_mapping.subprocess, "run", extract)
+
+    yield _StandIn
+    server.shutdown()
+
+
+def test_fetch_from_stand_in(stand_in):
+    json_version, jar_version, mapping = _mapping._fetch()
+
+    assert (json_version, jar_version) == ("9.9.0", "9.9")
+    assert mapping == {_mapping._hash(v): v for v in VALUES}
+    assert ("HEAD", "/releases/latest") in stand_in.hits
+    assert Path("tmp", "mapping.bin").exists()
+    assert not list(Path("tmp").glob("*.part"))
+    assert not Path("tmp", "fetch.lock").exists()
+
+    stand_in.hits.clear()
+    assert _mapping._fetch()[2] == mapping
+    assert not stand_in.hits
+
+
+def test_failed_update_falls_back_to_cache(stand_in, capsys):
+    mapping = _mapping._fetch()[2]
+    good = Path("tmp", "mapping.json").read_bytes()
+    stand_in.hits.clear()
+    stand_in.routes.clear()
+
+    assert _mapping._load(False)[2] == mapping
+    assert ("HEAD", "/releases/latest") in stand_in.hits
+    assert "fall back to the cached one" in capsys.readouterr().out
+    assert Path("tmp", "mapping.json").read_bytes() == good
+
+
+def test_bad_jar_falls_back_to_cache(stand_in, capsys):
+    mapping = _mapping._fetch()[2]
+    stand_in.hits.clear()
+    stand_in.routes["/NMSSaveEditor.jar"] = b"not a jar"
+
+    assert _mapping._load(False)[2] == mapping
+    assert ("GET", "/NMSSaveEditor.jar") in stand_in.hits
+    assert "fall back to the cached one" in capsys.readouterr().out
+
+
+def test_busy_lock_skips_refresh(stand_in):
+    Path("tmp").mkdir()
+    Path("tmp", "fetch.lock").touch()
+
+    with pytest.raises(BlockingIOError):
+        _mapping._fetch(True, True, True, False)
+    assert not stand_in.hits
@@ -0,0 +1,83 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from _codec import compress  # noqa: E402
+from _container import scan  # noqa: E402
+from watch import BackupStore  # noqa: E402
+
+SLICE = 64
+
+
+def _write_slot(directory, units):
+    save = compress(json.dumps({'Name': 'Explorer ' * 20, 'Units': units}, separators=(',', ':')).encode('utf-8'), SLICE)
+    (directory / 'save.hg').write_bytes(save)
+    # metadata is not a block container, it is kept as raw chunks
+    (directory / 'mf_save.hg').write_bytes(bytes(range(256)) * 3 + units.to_bytes(4, 'little'))
+    return [directory / 'save.hg', directory / 'mf_save.hg']
+
+
+def _objects(store):
+    return {path.name for path in store.objects.glob('*/*')}
+
+
+@pytest.fixture
+def saves(tmp_path):
+    (directory := tmp_path / 'saves').mkdir()
+    return directory
+
+
+def test_snapshot_dedupes_blocks(saves, tmp_path):
+    store = BackupStore(tmp_path / 'backup')
+    paths = _write_slot(saves, 1)
+
+    first = store.snapshot('save', paths)
+    assert first and store.manifests('save') == [first]
+    assert store.snapshot('save', paths) is None
+    objects = _objects(store)
+
+    _write_slot(saves, 2)
+    assert store.snapshot('save', paths)
+    # only the last block of the save and the single raw chunk of mf_save change
+    assert len(_objects(store) - objects) == 2
+    assert len(scan((saves / 'save.hg').read_bytes())) > 2
+    assert not list(store.root.glob('*/*.part'))
+
+
+def test_rotate_and_restore_byte_identical(saves, tmp_path):
+    store = BackupStore(tmp_path / 'backup', keep=2)
+    history = []
+    for units in range(3):
+        paths = _write_slot(saves, units)
+        history.append({path.name: path.read_bytes() for path in paths})
+        store.snapshot('save', paths)
+
+    manifests = store.manifests('save')
+    assert len(manifests) == 2
+    alive = {entry[0] for m in manifests for entries in store.read_manifest(m).values() for entry in entries}
+    assert _objects(store) == alive
+
+    for manifest, files in zip(manifests, history[1:]):
+        (dest := tmp_path / manifest.stem).mkdir()
+        store.restore(manifest, dest)
+        assert {path.name: path.read_bytes() for path in dest.iterdir()} == files
+
+
+def test_truncated_manifest_is_skipped(saves, tmp_path):
+    store = BackupStore(tmp_path / 'backup')
+    paths = _write_slot(saves, 1)
+    manifest = store.snapshot('save', paths)
+    broken = manifest.with_name('99999999-' + manifest.name)
+    broken.write_text(manifest.read_text()[:20])
+
+    # the broken manifest sorts last, the readable one before it is compared against instead
+    assert store.snapshot('save', paths) is None
+    store.collect()
+    with pytest.raises(ValueError):
+        store.restore(broken, tmp_path / 'restored')
+    store.restore(manifest, tmp_path / 'restored')
+    assert (tmp_path / 'restored' / 'save.hg').read_bytes() == paths[0].read_bytes()
@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import lz4.block as lb
+
+from _codec import write_file
+from _container import HEADER, iter_blocks, pack_header
+
+SAVE_GLOBS = ('save*.hg', 'mf_save*.hg')
+RAW_SLICE = 524288
+
+
+def slot_name(path):
+    name = Path(path).stem
+    return name[3:] if name.startswith('mf_') else name
+
+
+class BackupStore:
+    """Rotating snapshots of save slots, each LZ4 block stored once under its content hash."""
+
+    def __init__(self, root, keep=10):
+        self.root = Path(root)
+        self.objects = self.root / 'objects'
+        self.keep = keep
+        self.objects.mkdir(0o755, True, True)
+
+    def _put(self, blob):
+        digest = hashlib.blake2b(blob, digest_size=16).hexdigest()
+        if not (path := self.objects / digest[:2] / digest).exists():
+            path.parent.mkdir(0o755, True, True)
+            tmp = path.with_suffix('.tmp')
+            with open(tmp, 'wb') as f:
+                f.write(blob)
+            os.replace(tmp, path)
+        return digest
+
+    def _get(self, digest):
+        with open(self.objects / digest[:2] / digest, 'rb') as f:
+            return f.read()
+
+    # [digest, dest_size, raw]; raw chunks are bytes outside any block, compressed here for storage only
+    def _split(self, data):
+        entries = []
+        end = 0
+        for offset, dest_size, payload in iter_blocks(data):
+            entries.append([self._put(payload), dest_size, False])
+            end = offset + HEADER.size + len(payload)
+        while chunk := data[end:end + RAW_SLICE]:
+            entries.append([self._put(lb.compress(chunk, store_size=False)), len(chunk), True])
+            end += len(chunk)
+        return entries
+
+    def manifests(self, slot):
+        return sorted((self.root / slot).glob('*.json'))
+
+    # files of a manifest, None for one left unreadable by a crash
+    @staticmethod
+    def read_manifest(manifest):
+        try:
+            return json.loads(Path(manifest).read_text())['files']
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(':angri: Skip manifest', manifest, e)
+            return None
+
+    def snapshot(self, slot, paths):
+        files = {}
+        for path in paths:
+            with open(path, 'rb') as f:
+                files[Path(path).name] = self._split(f.read())
+
+        for latest in reversed(self.manifests(slot)):
+            if (latest_files := self.read_manifest(latest)) is not None:
+                if latest_files == files:
+                    return None
+                break
+
+        (slot_dir := self.root / slot).mkdir(0o755, True, True)
+        manifest = slot_dir / (datetime.now().strftime('%Y%m%d-%H%M%S-%f') + '.json')
+        part = manifest.with_name(manifest.name + '.part')
+        part.write_text(json.dumps({'slot': slot, 'files': files}, separators=(',', ':')))
+        os.replace(part, manifest)
+        self.rotate(slot)
+        return manifest
+
+    def rotate(self, slot):
+        if (history := self.manifests(slot)) and len(history) > self.keep:
+            for manifest in history[:-self.keep]:
+                manifest.unlink()
+            self.collect()
+
+    def collect(self):
+        alive = {
+            entry[0]
+            for manifest in self.root.glob('*/*.json')
+            for entries in (self.read_manifest(manifest) or {}).values()
+            for entry in entries
+        }
+        for path in self.objects.glob('*/*'):
+            if path.name not in alive:
+                path.unlink()
+
+    def restore(self, manifest, dest):
+        dest = Path(dest)
+        dest.mkdir(0o755, True, True)
+        if (files := self.read_manifest(manifest)) is None:
+            raise ValueError(f'unreadable manifest {manifest}')
+        # saves go first, so one failing its check leaves the whole slot untouched
+        for name in sorted(files, key=lambda n: n.startswith('mf_')):
+            data = b''
+            for digest, dest_size, raw in files[name]:
+                blob = self._get(digest)
+                if raw:
+                    data += lb.decompress(blob, uncompressed_size=dest_size)
+                else:
+                    data += pack_header(len(blob), dest_size) + blob
+            # mf_ files are metadata, not block containers
+            write_file(dest / name, data, not name.startswith('mf_'))
+
+
+class SaveWatcher:
+    """Poll a save directory and hand each slot over once its files stop changing for `debounce` seconds."""
+
+    def __init__(self, directory, store, debounce=5.0, interval=1.0, on_change=None):
+        self.directory = Path(directory)
+        self.store = store
+        self.debounce = debounce
+        self.interval = interval
+        self.on_change = on_change
+        self.seen = {}
+        self.pending = {}
+
+    def scan(self):
+        stats = {}
+        for pattern in SAVE_GLOBS:
+            for path in self.directory.glob(pattern):
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                stats[path] = (st.st_mtime_ns, st.st_size)
+        return stats
+
+    def poll(self):
+        now = time.monotonic()
+        stats = self.scan()
+        for path, sig in stats.items():
+            if self.seen.get(path) != sig:
+                self.pending[slot_name(path)] = now + self.debounce
+        self.seen = stats
+
+        for slot, deadline in list(self.pending.items()):
+            if deadline <= now:
+                del self.pending[slot]
+                self.flush(slot, [p for p in stats if slot_name(p) == slot])
+
+    def flush(self, slot, paths):
+        try:
+            manifest = self.store.snapshot(slot, paths)
+        except OSError as e:
+            # the game is probably still writing, try again after another quiet period
+            print(':angri:', e)
+            self.pending[slot] = time.monotonic() + self.debounce
+            return
+        if manifest:
+            print('Backup', slot, '->', manifest.name)
+            if self.on_change:
+                for path in paths:
+                    if not path.name.startswith('mf_'):
+                        # a failing conversion must not take the watcher down with it
+                        try:
+                            self.on_change(path)
+                        except Exception as e:
+                            print(':angri:', path.name, e)
+
+    def run(self):
+        while True:
+            self.poll()
+            time.sleep(self.interval)
+
+
+def converter(mode, out_dir):
+    out_dir = Path(out_dir)
+    out_dir.mkdir(0o755, True, True)
+    script = Path(__file__).with_name('convert.py')
+
+    def convert(path):
+        subprocess.run([sys.executable, str(script), '-i', str(path), '-o', str(out_dir / path.name), '-m', str(mode)])
+    return convert
+
+
+def executor(command):
+    def execute(path):
+        subprocess.run([arg.replace('{path}', str(path)) for arg in shlex.split(command, posix=os.name != 'nt')])
+    return execute
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dir', type=str, help='NMS save directory to watch')
+    parser.add_argument('-b', '--backup', type=str, default='backup', help='backup store directory')
+    parser.add_argument('-k', '--keep', type=int, default=10, help='backups kept per slot')
+    parser.add_argument('-d', '--debounce', type=float, default=5, help='seconds a slot must stay unchanged before backup')
+    parser.add_argument('-n', '--interval', type=float, default=1, help='polling interval in seconds')
+    parser.add_argument('-m', '--mode', type=int, default=None, help='convert each changed save, see convert.py')
+    parser.add_argument('-o', type=str, default='converted', help='output directory for converted saves')
+    parser.add_argument('-x', '--exec', type=str, default=None, help='command run on each changed save, {path} is replaced')
+    parser.add_argument('-r', '--restore', type=str, default=None, help='restore a backup manifest into dir and exit')
+    args = parser.parse_args()
+
+    store = BackupStore(args.backup, args.keep)
+    if args.restore:
+        store.restore(args.restore, args.dir)
+        sys.exit(0)
+
+    if hasattr(os, 'nice'):
+        os.nice(10)
+    on_change = None
+    if args.mode is not None:
+        on_change = converter(args.mode, args.o)
+    elif args.exec:
+        on_change = executor(args.exec)
+    try:
+        SaveWatcher(args.dir, store, args.debounce, args.interval, on_change).run()
+    except KeyboardInterrupt:
+        pass